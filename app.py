@@ -4,13 +4,18 @@ Provides REST API endpoints for CRUD operations on invoices,
 bulk operations, statistics, and a web interface for visualization.
 """
 
+import functools
 import logging
 import os
 import sqlite3
+import threading
+from collections.abc import Iterable, Iterator
 from datetime import datetime, timedelta
 from typing import Any, Final
 
-from flask import Flask, Response, jsonify, render_template, request
+import orjson
+from flask import Flask, Response, current_app, jsonify, render_template, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 
 logging.basicConfig(
@@ -19,36 +24,94 @@ logging.basicConfig(
 )
 logger: logging.Logger = logging.getLogger(__name__)
 
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider using orjson for request parsing and response serialization."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        """Serialize obj to a JSON string."""
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        """Deserialize a JSON string or bytes payload."""
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        """Build a JSON response from orjson's bytes without decoding them first."""
+        obj: Any = self._prepare_response_obj(args, kwargs)
+        return current_app.response_class(
+            orjson.dumps(obj), mimetype="application/json"
+        )
+
+
 app: Flask = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)  # Enable CORS for all routes (required for native mobile apps)
 DATABASE: Final[str] = os.environ.get("DATABASE_PATH", "invoices.db")
+# Bump whenever init_db gains a migration, table or index
+SCHEMA_VERSION: Final[int] = 1
 
 # Type alias for API responses that may include HTTP status codes
 ApiResponse = Response | tuple[Response, int]
 
 
-def get_db() -> sqlite3.Connection:
-    """Create and return a database connection with WAL mode enabled."""
+# Connections are reused per worker thread instead of opened per request
+_local: threading.local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """Open a new database connection with per-connection pragmas set."""
+    # The timeout doubles as SQLite's busy timeout for concurrent writers
     conn: sqlite3.Connection = sqlite3.connect(DATABASE, timeout=30.0)
     conn.row_factory = sqlite3.Row
-    # Enable WAL mode for better concurrency
-    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable under WAL and avoids an fsync on every commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def get_db() -> sqlite3.Connection:
+    """Return the current thread's database connection, opening it on first use."""
+    conn: sqlite3.Connection | None = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
     return conn
 
 
+@app.teardown_appcontext
+def release_db(exception: BaseException | None) -> None:
+    """Roll back any transaction a failed request left open on its connection."""
+    conn: sqlite3.Connection | None = getattr(_local, "conn", None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
 def strip_text(value: Any) -> str | None:
     """Strip whitespace from text values, returning None for empty strings."""
     if value is None:
         return None
-    stripped = str(value).strip()
-    return stripped if stripped else None
+    # JSON payloads nearly always carry strings; skip the redundant str() call
+    stripped = value.strip() if type(value) is str else str(value).strip()
+    return stripped or None
 
 
 def init_db() -> None:
     """Initialize the database schema and apply migrations if needed."""
-    conn: sqlite3.Connection = get_db()
+    conn: sqlite3.Connection = _connect()
     cursor: sqlite3.Cursor = conn.cursor()
 
+    # Enable WAL mode for better concurrency (persisted in the database file)
+    cursor.execute("PRAGMA journal_mode=WAL")
+
+    # Skip schema setup when another worker already brought the database up to date
+    cursor.execute("PRAGMA user_version")
+    if cursor.fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        logger.info("Database schema is up to date (version %d)", SCHEMA_VERSION)
+        return
+
+    # Hold the write lock for the whole setup so concurrent workers run it in turn
+    cursor.execute("BEGIN IMMEDIATE")
+
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS invoices (
@@ -94,9 +157,26 @@ def init_db() -> None:
         except sqlite3.OperationalError:
             logger.debug("Column 'category' already exists, skipping migration")
 
+    # Indexes are created after migrations since they reference migrated columns.
+    # The duplicate key index is not partial: imports also skip soft-deleted matches.
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invoices_dedup ON invoices (date, store, total)"
+    )
+    # Covers every column the listing and stats read from active invoices, so
+    # those scans never touch the table itself
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invoices_active_covering "
+        "ON invoices (deleted_at, date, store, category, total)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id "
+        "ON invoice_items (invoice_id)"
+    )
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
-    logger.info("Database initialized successfully")
+    logger.info("Database initialized successfully (schema version %d)", SCHEMA_VERSION)
 
 
 @app.route("/")
@@ -105,6 +185,78 @@ def index() -> str:
     return render_template("index.html")
 
 
+# Number of invoices serialized per chunk of a streamed listing response
+STREAM_BATCH_SIZE: Final[int] = 100
+
+
+def _group_invoice_rows(cursor: sqlite3.Cursor) -> Iterator[dict[str, Any]]:
+    """Yield invoices with their items from joined rows sorted by invoice.
+
+    Expects plain tuple rows in the listing query's column order.
+    """
+    invoice: dict[str, Any] | None = None
+    for invoice_id, date, store, category, total, item_name, item_price in cursor:
+        if invoice is None or invoice["id"] != invoice_id:
+            if invoice is not None:
+                yield invoice
+            invoice = {
+                "id": invoice_id,
+                "date": date,
+                "store": store,
+                "category": category,
+                "total": total,
+                "items": [],
+            }
+        # Invoices without items yield a single row with NULL item columns
+        if item_name is not None:
+            invoice["items"].append({"item_name": item_name, "item_price": item_price})
+    if invoice is not None:
+        yield invoice
+
+
+def _stream_json_array(objects: Iterable[Any]) -> Iterator[bytes]:
+    """Serialize objects as a JSON array, yielding it in batched chunks."""
+    batch: list[bytes] = []
+    separator: bytes = b"["
+    for obj in objects:
+        batch.append(separator + orjson.dumps(obj))
+        separator = b","
+        if len(batch) >= STREAM_BATCH_SIZE:
+            yield b"".join(batch)
+            batch.clear()
+    batch.append(b"]" if separator == b"," else b"[]")
+    yield b"".join(batch)
+
+
+# SQL clause per listing filter, in the order their parameters are bound
+INVOICE_FILTER_CLAUSES: Final[dict[str, str]] = {
+    "search": (
+        " AND (i.store LIKE ? OR i.id IN "
+        "(SELECT invoice_id FROM invoice_items WHERE item_name LIKE ?))"
+    ),
+    "store": " AND i.store = ?",
+    "category": " AND i.category = ?",
+    "date_from": " AND i.date >= ?",
+    "date_to": " AND i.date <= ?",
+}
+INVOICE_SORT_COLUMNS: Final[tuple[str, ...]] = ("date", "store", "total")
+
+
+@functools.cache
+def _build_invoices_query(active_filters: tuple[str, ...], sort_clause: str) -> str:
+    """Build the invoice listing query once per filter combination and sort order."""
+    # Exclude soft-deleted invoices. Items are joined in so the whole listing
+    # is fetched in one query instead of one query per invoice.
+    return (
+        "SELECT i.id, i.date, i.store, i.category, i.total, "
+        "ii.item_name, ii.item_price "
+        "FROM invoices i LEFT JOIN invoice_items ii ON ii.invoice_id = i.id "
+        "WHERE i.deleted_at IS NULL"
+        + "".join(INVOICE_FILTER_CLAUSES[name] for name in active_filters)
+        + f" ORDER BY {sort_clause}"
+    )
+
+
 @app.route("/api/invoices", methods=["GET"])
 def get_invoices() -> Response:
     """Retrieve all invoices with optional filtering and sorting."""
@@ -122,61 +274,32 @@ def get_invoices() -> Response:
         "sort_order": request.args.get("sort_order", "desc"),
     }
 
-    # Build query - exclude soft-deleted invoices
-    query: str = "SELECT * FROM invoices WHERE deleted_at IS NULL"
+    active_filters: tuple[str, ...] = tuple(
+        name for name in INVOICE_FILTER_CLAUSES if filters[name]
+    )
     params: list[str] = []
-
-    if filters["search"]:
-        query += (
-            " AND (store LIKE ? OR id IN "
-            "(SELECT invoice_id FROM invoice_items WHERE item_name LIKE ?))"
-        )
-        params.extend([f"%{filters['search']}%", f"%{filters['search']}%"])
-
-    if filters["store"]:
-        query += " AND store = ?"
-        params.append(filters["store"])
-
-    if filters["category"]:
-        query += " AND category = ?"
-        params.append(filters["category"])
-
-    if filters["date_from"]:
-        query += " AND date >= ?"
-        params.append(filters["date_from"])
-
-    if filters["date_to"]:
-        query += " AND date <= ?"
-        params.append(filters["date_to"])
-
-    # Sorting
-    if filters["sort_by"] in ["date", "store", "total"]:
+    for name in active_filters:
+        if name == "search":
+            params.extend([f"%{filters['search']}%", f"%{filters['search']}%"])
+        else:
+            params.append(filters[name])
+
+    # Sorting - the id columns keep each invoice's rows together and its
+    # items in insertion order
+    sort_clause: str = "i.id, ii.id"
+    if filters["sort_by"] in INVOICE_SORT_COLUMNS:
         order: str = "DESC" if filters["sort_order"] == "desc" else "ASC"
-        query += f" ORDER BY {filters['sort_by']} {order}"
+        sort_clause = f"i.{filters['sort_by']} {order}, {sort_clause}"
 
+    query: str = _build_invoices_query(active_filters, sort_clause)
+    # Plain tuples avoid building a sqlite3.Row for every joined row
+    cursor.row_factory = None
     cursor.execute(query, params)
 
-    result: list[dict[str, str | list[dict[str, str]]]] = []
-    for invoice in cursor.fetchall():
-        cursor.execute(
-            "SELECT * FROM invoice_items WHERE invoice_id = ?", (invoice["id"],)
-        )
-        result.append(
-            {
-                "id": invoice["id"],
-                "date": invoice["date"],
-                "store": invoice["store"],
-                "category": invoice["category"],
-                "total": invoice["total"],
-                "items": [
-                    {"item_name": item["item_name"], "item_price": item["item_price"]}
-                    for item in cursor.fetchall()
-                ],
-            }
-        )
-
-    conn.close()
-    return jsonify(result)
+    # Stream straight from the cursor instead of materializing the full list
+    return Response(
+        _stream_json_array(_group_invoice_rows(cursor)), mimetype="application/json"
+    )
 
 
 @app.route("/api/stores", methods=["GET"])
@@ -188,7 +311,6 @@ def get_stores() -> Response:
         "SELECT DISTINCT store FROM invoices WHERE deleted_at IS NULL ORDER BY store"
     )
     stores: list[str] = [row["store"] for row in cursor.fetchall()]
-    conn.close()
     return jsonify(stores)
 
 
@@ -202,7 +324,6 @@ def get_categories() -> Response:
         "WHERE deleted_at IS NULL AND category IS NOT NULL ORDER BY category"
     )
     categories: list[str] = [row["category"] for row in cursor.fetchall()]
-    conn.close()
     return jsonify(categories)
 
 
@@ -224,15 +345,17 @@ def add_invoice() -> Response:
     )
     invoice_id: int | None = cursor.lastrowid
 
-    for item in data.get("items", []):
-        cursor.execute(
-            "INSERT INTO invoice_items (invoice_id, item_name, item_price) VALUES (?, ?, ?)",
-            (invoice_id, strip_text(item["item_name"]), float(item["item_price"])),
-        )
+    item_rows: list[tuple[int | None, str | None, float]] = [
+        (invoice_id, strip_text(item["item_name"]), float(item["item_price"]))
+        for item in data.get("items", [])
+    ]
+    cursor.executemany(
+        "INSERT INTO invoice_items (invoice_id, item_name, item_price) VALUES (?, ?, ?)",
+        item_rows,
+    )
 
     conn.commit()
-    conn.close()
-    item_count = len(data.get("items", []))
+    item_count = len(item_rows)
     logger.info(
         "Invoice created: id=%s, store='%s', total=%.2f, items=%d",
         invoice_id,
@@ -252,43 +375,63 @@ def import_invoices() -> ApiResponse:
 
     imported_count: int = 0
     skipped_count: int = 0
+    item_rows: list[tuple[int | None, str | None, float]] = []
 
-    try:
-        for invoice_data in data:
-            store = strip_text(invoice_data["store"])
-            date = strip_text(invoice_data["date"])
-            category = strip_text(invoice_data.get("category"))
-            total = float(invoice_data["total"])
+    # Duplicate check key: same combination of date, store and total amount
+    keys: list[tuple[str | None, str | None, float]] = [
+        (
+            strip_text(invoice_data["date"]),
+            strip_text(invoice_data["store"]),
+            float(invoice_data["total"]),
+        )
+        for invoice_data in data
+    ]
 
-            # Duplicate check: same combination of date, store and total amount
-            cursor.execute(
-                "SELECT id FROM invoices WHERE date = ? AND store = ? AND total = ?",
-                (date, store, total),
-            )
-            existing: Any = cursor.fetchone()
+    try:
+        # Take the write lock up front so the duplicate keys read below stay
+        # valid until the inserts are committed
+        cursor.execute("BEGIN IMMEDIATE")
+
+        # Look up all incoming keys in one query, bound as a single JSON array,
+        # instead of querying once per imported row. Plain tuple rows double as
+        # the keys themselves.
+        cursor.row_factory = None
+        cursor.execute(
+            "SELECT i.date, i.store, i.total FROM json_each(?) AS k "
+            "JOIN invoices AS i ON i.date = json_extract(k.value, '$[0]') "
+            "AND i.store = json_extract(k.value, '$[1]') "
+            "AND i.total = json_extract(k.value, '$[2]')",
+            (app.json.dumps(keys),),
+        )
+        existing_keys: set[tuple[str | None, str | None, float]] = set(
+            cursor.fetchall()
+        )
 
-            if existing:
+        for invoice_data, key in zip(data, keys):
+            if key in existing_keys:
                 skipped_count += 1
                 continue
 
+            date, store, total = key
+            category = strip_text(invoice_data.get("category"))
             cursor.execute(
                 "INSERT INTO invoices (date, store, category, total) VALUES (?, ?, ?, ?)",
                 (date, store, category, total),
             )
             invoice_id: int | None = cursor.lastrowid
+            # Also skip duplicates within the imported batch itself
+            existing_keys.add(key)
 
-            for item in invoice_data.get("items", []):
-                cursor.execute(
-                    "INSERT INTO invoice_items "
-                    "(invoice_id, item_name, item_price) VALUES (?, ?, ?)",
-                    (
-                        invoice_id,
-                        strip_text(item["item_name"]),
-                        float(item["item_price"]),
-                    ),
-                )
+            item_rows.extend(
+                (invoice_id, strip_text(item["item_name"]), float(item["item_price"]))
+                for item in invoice_data.get("items", [])
+            )
             imported_count += 1
 
+        cursor.executemany(
+            "INSERT INTO invoice_items (invoice_id, item_name, item_price) VALUES (?, ?, ?)",
+            item_rows,
+        )
         conn.commit()
         logger.info(
             "Import completed: imported=%d, skipped=%d (of %d total)",
@@ -303,8 +446,6 @@ def import_invoices() -> ApiResponse:
         conn.rollback()
         logger.error("Import failed: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @app.route("/api/invoices/<int:invoice_id>", methods=["PUT"])
@@ -331,14 +472,17 @@ def update_invoice(invoice_id: int) -> ApiResponse:
         cursor.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
 
         # Insert new items
-        for item in data.get("items", []):
-            cursor.execute(
-                "INSERT INTO invoice_items (invoice_id, item_name, item_price) VALUES (?, ?, ?)",
-                (invoice_id, strip_text(item["item_name"]), float(item["item_price"])),
-            )
+        item_rows: list[tuple[int, str | None, float]] = [
+            (invoice_id, strip_text(item["item_name"]), float(item["item_price"]))
+            for item in data.get("items", [])
+        ]
+        cursor.executemany(
+            "INSERT INTO invoice_items (invoice_id, item_name, item_price) VALUES (?, ?, ?)",
+            item_rows,
+        )
 
         conn.commit()
-        item_count = len(data.get("items", []))
+        item_count = len(item_rows)
         logger.info(
             "Invoice updated: id=%d, store='%s', total=%.2f, items=%d",
             invoice_id,
@@ -351,8 +495,6 @@ def update_invoice(invoice_id: int) -> ApiResponse:
         conn.rollback()
         logger.error("Failed to update invoice id=%d: %s", invoice_id, e)
         return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @app.route("/api/invoices/<int:invoice_id>", methods=["DELETE"])
@@ -366,7 +508,6 @@ def delete_invoice(invoice_id: int) -> Response:
         (invoice_id,),
     )
     conn.commit()
-    conn.close()
     logger.info("Invoice soft-deleted: id=%d", invoice_id)
     return jsonify({"success": True})
 
@@ -389,9 +530,8 @@ def bulk_update_invoices() -> ApiResponse:
     cursor: sqlite3.Cursor = conn.cursor()
 
     try:
-        placeholders: str = ",".join("?" * len(invoice_ids))
         set_clauses: list[str] = []
-        params: list[str | int | None] = []
+        params: list[str | None] = []
 
         if new_store:
             set_clauses.append("store = ?")
@@ -402,9 +542,11 @@ def bulk_update_invoices() -> ApiResponse:
             # Empty string means remove category (set to NULL)
             params.append(strip_text(new_category))
 
-        params.extend(invoice_ids)
+        # Ids are bound as one JSON array, avoiding SQLite's bound-variable limit
+        params.append(app.json.dumps(invoice_ids))
         cursor.execute(
-            f"UPDATE invoices SET {', '.join(set_clauses)} WHERE id IN ({placeholders})",
+            f"UPDATE invoices SET {', '.join(set_clauses)} "
+            "WHERE id IN (SELECT value FROM json_each(?))",
             params,
         )
         updated_count: int = cursor.rowcount
@@ -419,8 +561,6 @@ def bulk_update_invoices() -> ApiResponse:
         conn.rollback()
         logger.error("Bulk update failed for ids=%s: %s", invoice_ids, e)
         return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 @app.route("/api/invoices/bulk-delete", methods=["POST"])
@@ -436,11 +576,12 @@ def bulk_delete_invoices() -> ApiResponse:
     cursor: sqlite3.Cursor = conn.cursor()
 
     try:
-        placeholders: str = ",".join("?" * len(invoice_ids))
-        # Soft delete: set deleted_at timestamp instead of removing from database
+        # Soft delete: set deleted_at timestamp instead of removing from database.
+        # Ids are bound as one JSON array, avoiding SQLite's bound-variable limit.
         cursor.execute(
-            f"UPDATE invoices SET deleted_at = CURRENT_TIMESTAMP WHERE id IN ({placeholders})",
-            invoice_ids,
+            "UPDATE invoices SET deleted_at = CURRENT_TIMESTAMP "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (app.json.dumps(invoice_ids),),
         )
         deleted_count: int = cursor.rowcount
         conn.commit()
@@ -454,8 +595,6 @@ def bulk_delete_invoices() -> ApiResponse:
         conn.rollback()
         logger.error("Bulk delete failed for ids=%s: %s", invoice_ids, e)
         return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        conn.close()
 
 
 def _calculate_comparison(
@@ -519,49 +658,56 @@ def get_stats() -> Response:
         base_conditions += " AND date <= ?"
         params.append(date_to)
 
-    # Summary statistics
+    # Summary, category and store aggregates in one statement over a single
+    # materialized scan of the filtered invoices
     cursor.execute(
-        f"SELECT COUNT(*) as count, SUM(total) as sum FROM invoices WHERE {base_conditions}",
+        f"""WITH filtered AS MATERIALIZED (
+                SELECT store, category, total FROM invoices WHERE {base_conditions}
+            )
+            SELECT 'summary' as kind, NULL as name,
+                   SUM(total) as amount, COUNT(*) as count FROM filtered
+            UNION ALL
+            SELECT 'category', COALESCE(category, 'Uncategorized'),
+                   SUM(total), COUNT(*) FROM filtered GROUP BY category
+            UNION ALL
+            SELECT 'store', store, SUM(total), COUNT(*) FROM filtered GROUP BY store""",
         params,
     )
-    row = cursor.fetchone()
-    total_invoices: int = row["count"]
-    total_amount: float = row["sum"] or 0
+    total_invoices: int = 0
+    total_amount: float = 0
+    category_rows: list[sqlite3.Row] = []
+    store_rows: list[sqlite3.Row] = []
+    for r in cursor.fetchall():
+        if r["kind"] == "summary":
+            total_invoices = r["count"]
+            total_amount = r["amount"] or 0
+        elif r["kind"] == "category":
+            category_rows.append(r)
+        else:
+            store_rows.append(r)
 
     average_invoice: float = total_amount / total_invoices if total_invoices > 0 else 0
 
     # Category breakdown
-    cursor.execute(
-        f"""SELECT COALESCE(category, 'Uncategorized') as category,
-                   SUM(total) as amount, COUNT(*) as count
-            FROM invoices WHERE {base_conditions}
-            GROUP BY category ORDER BY amount DESC""",
-        params,
-    )
+    category_rows.sort(key=lambda r: r["amount"], reverse=True)
     by_category: list[dict[str, Any]] = [
         {
-            "category": r["category"],
+            "category": r["name"],
             "amount": round(r["amount"], 2),
             "count": r["count"],
         }
-        for r in cursor.fetchall()
+        for r in category_rows
     ]
 
     # Store breakdown (top 10)
-    cursor.execute(
-        f"""SELECT store, SUM(total) as amount, COUNT(*) as count
-            FROM invoices WHERE {base_conditions}
-            GROUP BY store ORDER BY amount DESC LIMIT 10""",
-        params,
-    )
+    store_rows.sort(key=lambda r: r["amount"], reverse=True)
     by_store: list[dict[str, Any]] = [
-        {"store": r["store"], "amount": round(r["amount"], 2), "count": r["count"]}
-        for r in cursor.fetchall()
+        {"store": r["name"], "amount": round(r["amount"], 2), "count": r["count"]}
+        for r in store_rows[:10]
     ]
 
     comparison = _calculate_comparison(cursor, date_from, date_to, total_amount)
 
-    conn.close()
     return jsonify(
         {
             "summary": {